@@ -4,6 +4,9 @@ Author: Grayson Bellamy
 Date: 2024-01-05
 """
 
+import array
+import os
+import sys
 from abc import ABC, abstractmethod
 from collections.abc import ByteString
 
@@ -13,6 +16,53 @@ from anyserial import SerialStream
 from anyserial.abstract import Parity, StopBits
 
 
+def _decode(line: bytes) -> str:
+    """Decodes a line received from the device, removing any null padding.
+
+    Args:
+        line (bytes): The line as received.
+
+    Returns:
+        str: The decoded line.
+    """
+    if b"\x00" in line:
+        line = line.translate(None, b"\x00")
+    return line.decode("ascii")
+
+
+def _set_low_latency(port: str) -> bool:
+    """Asks the driver of a serial port to pass on received bytes without delay.
+
+    USB serial adapters otherwise buffer incoming bytes for up to 16 ms before handing them over.
+    Only supported on Linux, and only by drivers which honour ASYNC_LOW_LATENCY.
+
+    Args:
+        port (str): The port to which the device is connected.
+
+    Returns:
+        bool: Whether low latency mode was set.
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+    import termios
+
+    try:
+        fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    except OSError:
+        return False
+    try:
+        serial_struct = array.array("i", [0] * 32)
+        fcntl.ioctl(fd, termios.TIOCGSERIAL, serial_struct)
+        serial_struct[4] |= 0x2000  # ASYNC_LOW_LATENCY in the flags field
+        fcntl.ioctl(fd, termios.TIOCSSERIAL, serial_struct)
+    except (OSError, AttributeError):
+        return False
+    finally:
+        os.close(fd)
+    return True
+
+
 class CommDevice(ABC):
     """Sets up the communication for the an Alicat device."""
 
@@ -166,6 +216,8 @@ class SerialDevice(CommDevice):
     async def _readline(self) -> str:
         """Reads the serial communication until end-of-line character reached.
 
+        Null padding sent by the device is removed before decoding.
+
         Returns:
             str: The serial communication.
         """
@@ -204,13 +256,17 @@ class SerialDevice(CommDevice):
                     while c is None:  # Keep reading until a character is read
                         c = await self._read()
                         await anyio.lowlevel.checkpoint()
+                if c is None:  # if we reach timeout, return what we have
+                    break
                 line += c
         self.isOpen = False
-        return line.decode("ascii")
+        return _decode(line)
 
     async def _write_readline(self, command: str) -> str:
         """Writes the serial communication and reads the response until end-of-line character reached.
 
+        Null padding sent by the device is removed before decoding.
+
         Parameters:
             command (str): The serial communication.
 
@@ -253,9 +309,21 @@ class SerialDevice(CommDevice):
                     while c is None:  # Keep reading until a character is read
                         c = await self._read()
                         await anyio.lowlevel.checkpoint()
+                if c is None:  # if we reach timeout, return what we have
+                    break
                 line += c
         self.isOpen = False
-        return line.decode("ascii")
+        return _decode(line)
+
+    def set_low_latency(self) -> bool:
+        """Asks the driver of the port to pass on received bytes without delay.
+
+        Changes a setting of the port itself, so only call it once the device on the port is known.
+
+        Returns:
+            bool: Whether low latency mode was set.
+        """
+        return _set_low_latency(self.serial_setup["port"])
 
     async def _flush(self) -> None:
         """Flushes the serial communication."""
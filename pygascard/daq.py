@@ -7,18 +7,52 @@ Date: 2024-01-07
 import time
 import warnings
 from datetime import datetime
+from functools import lru_cache
 from queue import Queue
 from threading import Thread
 from typing import Any, Callable
 
 import asyncpg
-from anyio import create_task_group, run
+from anyio import create_task_group, run, sleep, to_thread
 
 from pygascard import device
 
 warnings.filterwarnings("always")
 
 
+def _column_name(key: str) -> str:
+    """Converts a key to the name of its database column.
+
+    Args:
+        key (str): The key of the value.
+
+    Returns:
+        str: The column name, lowercase with whitespace removed.
+    """
+    return "".join(key.split()).lower()
+
+
+@lru_cache
+def _insert_query(keys: tuple[str, ...]) -> str:
+    """Builds the statement inserting a row with the given keys.
+
+    Rows from the same device have the same keys on every reading, so the statement is only built once.
+
+    Args:
+        keys (tuple[str, ...]): The keys of the row, in order.
+
+    Returns:
+        str: The insert statement.
+    """
+    return (
+        "INSERT INTO gascard ("
+        + ", ".join([_column_name(key) for key in keys])
+        + ") VALUES ("
+        + ", ".join(["$" + str(i + 1) for i in range(len(keys))])
+        + ")"
+    )
+
+
 class DAQ:
     """Class for managing gascard devices. Accessible to external API and internal logging module. Wraps and allows communication with inidividual or all devices through wrapper class."""
 
@@ -130,10 +164,10 @@ class DAQ:
         If id not specified, returns data from all devices.
 
         Example:
-            df = run(Daq.get, ["Gas Type", "Gas Range", "Conc 1"], ['A', 'B'])
-            df = run(Daq.get, ["Gas Type", "Gas Range", "Conc 1"])
-            df = run(Daq.get, ["Gas Type", "Gas Range", "Conc 1"], 'B')
-            df = run(Daq.get, "Gas Type")
+            df = run(Daq.get, ["Gas_Type", "Gas_Range", "Conc_1"], ['A', 'B'])
+            df = run(Daq.get, ["Gas_Type", "Gas_Range", "Conc_1"])
+            df = run(Daq.get, ["Gas_Type", "Gas_Range", "Conc_1"], 'B')
+            df = run(Daq.get, "Gas_Type")
 
         Args:
            val (list): The values to get from the device.
@@ -180,9 +214,9 @@ class DAQ:
         """Sets the data of the device.
 
         Example:
-            df = run(Daq.set, {"Setpt": 50})
-            df = run(Daq.set, {"Setpt": 50}, ['A', 'B'])
-            df = run(Daq.set, {"Setpt": 50}, ["B"])
+            df = run(Daq.set, {"Time_Constant": 1})
+            df = run(Daq.set, {"Time_Constant": 1}, ['A', 'B'])
+            df = run(Daq.set, {"Time_Constant": 1}, ["B"])
 
         Args:
            command (dict): The commands and their relevant parameters to send to the device.
@@ -204,6 +238,55 @@ class DAQ:
                     g.start_soon(self.update_dict_set, ret_dict, i, command)
         return ret_dict
 
+    async def update_dict_set_and_read(
+        self,
+        ret_dict: dict[str, dict[str, str | float]],
+        dev: str,
+        command: dict[str, str | float],
+    ) -> dict[str, dict[str, str | float]]:
+        """Updates the dictionary with the values read back after setting them.
+
+        Args:
+            ret_dict (dict): The dictionary of devices to update.
+            dev (str): The name of the device.
+            command (dict): The commands and their relevant parameters to send to the device.
+
+        Returns:
+            dict: The dictionary of devices with the updated values.
+        """
+        await self._dev_list[dev].set(command)
+        ret_dict.update({dev: await self._dev_list[dev].get(list(command))})
+        return ret_dict
+
+    async def set_and_read(
+        self, command: dict[str, str | float], id: list[str] | None = None
+    ) -> dict[str, dict[str, str | float]]:
+        """Sets the data of the device and reads the same values back.
+
+        The read back starts from the mode left by the set, so it costs a single line per mode.
+
+        Example:
+            df = run(Daq.set_and_read, {"Time_Constant": 1})
+            df = run(Daq.set_and_read, {"Time_Constant": 1}, ["B"])
+
+        Args:
+           command (dict): The commands and their relevant parameters to send to the device.
+           id (list): The IDs of the devices to set. If not specified, sets all devices.
+
+        Returns:
+            dict: The dictionary of devices with the values read back.
+        """
+        ret_dict = {}
+        if not id:
+            async with create_task_group() as g:
+                for dev in self._dev_list:
+                    g.start_soon(self.update_dict_set_and_read, ret_dict, dev, command)
+        else:
+            async with create_task_group() as g:
+                for i in id:
+                    g.start_soon(self.update_dict_set_and_read, ret_dict, i, command)
+        return ret_dict
+
     async def zero(self, id: list[str] | None = None) -> None:
         """Sets the zero reference of the device.
 
@@ -220,10 +303,10 @@ class DAQ:
         """
         if not id:
             for dev in self._dev_list:
-                await self._dev_list[dev].set({"Zero Gas Corr Factor": ""})
+                await self._dev_list[dev].zero()
         else:
             for i in id:
-                await self._dev_list[i].set({"Zero Gas Corr Factor": ""})
+                await self._dev_list[i].zero()
         return
 
     async def span(self, val: float, id: list[str] | None = None) -> None:
@@ -243,10 +326,10 @@ class DAQ:
         """
         if not id:
             for dev in self._dev_list:
-                await self._dev_list[dev].set({"Span Gas Corr Factor": val})
+                await self._dev_list[dev].span(val)
         else:
             for i in id:
-                await self._dev_list[i].set({"Span Gas Corr Factor": val})
+                await self._dev_list[i].span(val)
         return
 
     async def time_const(self, val: int, id: list[str] | None = None) -> None:
@@ -267,6 +350,30 @@ class DAQ:
                 await self._dev_list[i].time_const(val)
         return
 
+    async def coefficients(
+        self, a: float, b: float, c: float, d: float, id: list[str] | None = None
+    ) -> None:
+        """Sets the linearisation coefficients of the devices.
+
+        Each device is on its own port, so they are all loaded at the same time.
+
+        Example:
+            df = run(Daq.coefficients, 0.1, 0.2, 0.3, 0.4, ['A', 'B'])
+
+        Args:
+            a (float): Coefficient A
+            b (float): Coefficient B
+            c (float): Coefficient C
+            d (float): Coefficient D
+            id (list[str]): The IDs of the devices to set. If not specified, sets all devices.
+        """
+        if not id:
+            id = list(self._dev_list)
+        async with create_task_group() as g:
+            for i in id:
+                g.start_soon(self._dev_list[i].coefficients, a, b, c, d)
+        return
+
 
 class AsyncPG:
     """Async context manager for connecting to a PostgreSQL database using asyncpg."""
@@ -346,7 +453,7 @@ class DAQLogging:
                 elif isinstance(dict[key], float):
                     data_type = "float"
                 await conn.execute(
-                    f"ALTER TABLE gascard ADD COLUMN IF NOT EXISTS {''.join(key.split()).lower()} {data_type}"
+                    f"ALTER TABLE gascard ADD COLUMN IF NOT EXISTS {_column_name(key)} {data_type}"
                 )
             await conn.execute(
                 "SELECT create_hypertable('gascard', by_range('time'), if_not_exists => TRUE)"
@@ -363,11 +470,7 @@ class DAQLogging:
         async with conn.transaction():
             for dev in dict:
                 await conn.execute(
-                    "INSERT INTO gascard ("
-                    + ", ".join([key.lower().replace(" ", "") for key in dev.keys()])
-                    + ") VALUES ("
-                    + ", ".join(["$" + str(i + 1) for i in range(len(dev))])
-                    + ")",
+                    _insert_query(tuple(dev)),
                     *dev.values(),
                     # We could optimize this by using a single insert statement for all devices. We would have to make sure that the order of the values is the same for all devices and it would only work if they all have the same fields. That is, it wouldn't work for the flowmeter in our case because it has RH values
                 )
@@ -417,7 +520,7 @@ class DAQLogging:
                     # if stop_logging is in the queue, break out of the while loop
                     if comm == "Stop":
                         break
-                    elif isinstance(comm, list) and isinstance(comm[0], function):
+                    elif isinstance(comm, list) and callable(comm[0]):
                         df = await comm[0](*comm[1:])
                         self.qout.put(df)
                 # if not, continue logging
@@ -532,7 +635,7 @@ class DAQLogging:
         """Test function for the DAQLogging class."""
         print(f"State 1 = {state1}")
         print(f"State 2 = {state2}")
-        time.sleep(10)
+        await sleep(10)
         return
 
     async def set(self, *args):
@@ -545,7 +648,8 @@ class DAQLogging:
             *args: The arguments to pass to the set function.
         """
         self.qin.put([self.Daq.set, *args])
-        return self.qout.get()
+        # Wait off the event loop for the logging thread to answer
+        return await to_thread.run_sync(self.qout.get)
 
     async def get(self, *args):
         """Get function for the DAQLogging class.
@@ -557,4 +661,4 @@ class DAQLogging:
             *args: The arguments to pass to the get function.
         """
         self.qin.put([self.Daq.get, *args])
-        return self.qout.get()
+        return await to_thread.run_sync(self.qout.get)
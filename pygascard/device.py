@@ -12,27 +12,97 @@ Returns:
 
 import importlib.resources
 import json
+import time
 from abc import ABC
+from collections import defaultdict
 from typing import Any
 
+import anyio
+
 from pygascard.comm import SerialDevice
 
 codes_path = importlib.resources.files("pygascard").joinpath("codes.json")
 with open(codes_path) as f:
     codes = json.load(f)
 values = codes["values"]
-N_labels = values["N"][0]
-N1_labels = values["N1"][0]
-C1_labels = values["C1"][0]
-E1_labels = values["E1"][0]
-O1_labels = values["O1"][0]
-X_labels = values["X"][0]
-U_labels = values["U"][0]
+N_labels = tuple(values["N"][0])
+N1_labels = tuple(values["N1"][0])
+C1_labels = tuple(values["C1"][0])
+E1_labels = tuple(values["E1"][0])
+O1_labels = tuple(values["O1"][0])
+X_labels = tuple(values["X"][0])
+U_labels = tuple(values["U"][0])
+# Mode and command prefix for each name, so lookups don't have to search every mode
+name_index = {
+    name: (mode, command)
+    for mode, (names, commands) in values.items()
+    for name, command in zip(names, commands)
+}
+# Names which have a command to set them, the rest are read only
+settable = frozenset(name for name, (_, command) in name_index.items() if command)
+mode_labels = {
+    "N": N_labels,
+    "N1": N1_labels,
+    "C1": C1_labels,
+    "E1": E1_labels,
+    "O1": O1_labels,
+    "X": X_labels,
+    "U": U_labels,
+}
+mode_names = {
+    "N": "Normal",
+    "N1": "Normal Channel",
+    "C1": "Coefficient",
+    "E1": "Environmental",
+    "O1": "Output",
+    "X": "Settings",
+    "U": "User Interface",
+}
+MODE_ATTEMPTS = 5  # Number of times a mode change is sent before giving up
+
+
+def _maybe_float(val: str) -> str | float:
+    """Converts a value to a float if it is numeric.
+
+    Args:
+        val (str): Value as sent by the device
+
+    Returns:
+        str | float: The value as a float, or unchanged if it is not numeric
+    """
+    try:
+        return float(val)
+    except ValueError:
+        return val
+
+
+def _parse_row(ret: str, mode: str) -> dict[str, str | float]:
+    """Checks a line is in the given mode and pairs its values with their names.
+
+    The card starts every line with the token of its mode (N, N1, C1, E1, O1, X or U) followed by a space,
+    the same tokens SerialDevice.codes_list uses to find the start of a line. The first token must therefore
+    equal the mode exactly, so a line from another mode, such as N1 while N was asked for, is rejected
+    instead of being paired with the wrong names.
+
+    Args:
+        ret (str): Line as sent by the device
+        mode (str): Mode the line is expected to be in
+
+    Returns:
+        dict[str, str | float]: Dictionary of names with their values
+    """
+    df = ret.split()
+    if not df or df[0] != mode:
+        raise ValueError(f"Gas Card Not in {mode_names[mode]} Mode")
+    return dict(zip(mode_labels[mode], map(_maybe_float, df)))
 
 
 class Gascard(ABC):
     """Gascard class."""
 
+    __slots__ = ("_device", "_dev_info", "_current_mode", "_cache", "cache_ttl")
+    _MODES = ("N", "N1", "C1", "E1", "O1", "D", "X", "U")
+
     def __init__(
         self, device: SerialDevice, dev_info: dict[str, str], **kwargs: Any
     ) -> None:
@@ -45,20 +115,18 @@ class Gascard(ABC):
         """
         self._device = device
         self._dev_info = dev_info
-        self._current_mode = "U"
-        self._MODES = (
-            "N",
-            "N1",
-            "C1",
-            "E1",
-            "O1",
-            "D",
-            "X",
-            "U",
-        )
+        self._current_mode: str | None = None  # Unknown until the device answers in a mode
+        self._cache: dict[str, tuple[float, dict[str, str | float]]] = {}
+        self.cache_ttl = 0.0  # Seconds a reading is reused for, 0 to always read
 
     @classmethod
-    async def new_device(cls, port: str, **kwargs: Any) -> "Gascard":
+    async def new_device(
+        cls,
+        port: str,
+        probe_timeout: float = 2.0,
+        low_latency: bool = True,
+        **kwargs: Any,
+    ) -> "Gascard":
         """Creates a new device. Chooses appropriate device based on characteristics.
 
         Example:
@@ -66,22 +134,63 @@ class Gascard(ABC):
 
         Args:
             port (str): The port of the device.
+            probe_timeout (float): Time in seconds to wait for the device to answer before giving up.
+            low_latency (bool): Whether to ask the port's driver to pass on received bytes without delay once the device is confirmed.
+            **kwargs: Any
+
+        Returns:
+            Device: The new device.
+
+        Raises:
+            ValueError: If the port is not supported or holds no gas card.
+            TimeoutError: If the device does not answer within probe_timeout.
+        """
+        if not port.startswith("/dev/"):
+            raise ValueError(f"Unsupported Port {port}")
+        device = SerialDevice(port, **kwargs)
+        with anyio.move_on_after(probe_timeout) as scope:
+            for attempt in range(MODE_ATTEMPTS):
+                df = (await device._write_readline("U")).split()
+                if not df or df[0] not in cls._MODES:  # Gas cards always answer in a mode
+                    raise ValueError("No device found on port")
+                if df[0] == "U":
+                    break
+                await anyio.sleep(0.01 * 2**attempt)
+            else:
+                raise ValueError("Gas Card Not in User Interface Mode")
+        if scope.cancelled_caught:
+            raise TimeoutError(f"Gas Card on {port} Not Responding")
+        dev = cls.from_info(port, dict(zip(U_labels, df)), low_latency, **kwargs)
+        dev._current_mode = "U"  # The probe just answered in User Interface mode
+        return dev
+
+    @classmethod
+    def from_info(
+        cls,
+        port: str,
+        dev_info: dict[str, str],
+        low_latency: bool = True,
+        **kwargs: Any,
+    ) -> "Gascard":
+        """Creates a device on a port already known to hold a gas card, without probing it.
+
+        The mode of the device is unknown, so the first read or write switches it to the mode needed.
+
+        Example:
+            dev = Gascard.from_info("/dev/ttyUSB4", dev_info)
+
+        Args:
+            port (str): The port of the device.
+            dev_info (dict[str, str]): The device information from an earlier User Interface reply.
+            low_latency (bool): Whether to ask the port's driver to pass on received bytes without delay.
             **kwargs: Any
 
         Returns:
             Device: The new device.
         """
-        if port.startswith("/dev/"):
-            device = SerialDevice(port, **kwargs)
-        await device._write("U")
-        dev_info_raw = await device._readline()
-        if not dev_info_raw:
-            raise ValueError("No device found on port")
-        dev_info_raw = dev_info_raw.replace("\x00", "")
-        dev_info = dict(zip(U_labels, dev_info_raw.split()))
-        if "U" not in dev_info_raw.split()[0]:
-            # print("Error: Gas Card Not in User Interface Mode")
-            raise ValueError("Gas Card Not in User Interface Mode")
+        device = SerialDevice(port, **kwargs)
+        if low_latency:
+            device.set_low_latency()
         return cls(device, dev_info, **kwargs)
 
     async def _get_mode(self) -> str:
@@ -91,25 +200,72 @@ class Gascard(ABC):
             str: Current mode of device
         """
         ret = await self._device._readline()
-        mode = ret[:2].strip()
+        mode = "".join(ret.split()[:1])
         if mode in self._MODES:
-            self.current_mode = mode
+            self._current_mode = mode
         else:
             raise ValueError("Invalid Mode")
         return mode
 
-    async def _set_mode(self, mode: str) -> None:
+    async def _set_mode(self, mode: str) -> str:
         """Sets the mode of the device.
 
+        The mode is resent with an increasing delay until the device answers in it, giving up after a few attempts. The first line sent by the device in the new mode is returned so callers can use it instead of waiting for another one.
+
         Args:
             mode (str): Desired mode for device
+
+        Returns:
+            str: First line received after the mode change
         """
-        if mode in self._MODES:
-            await self._device._write(mode)
-            self._current_mode = mode
-        else:
+        if mode not in self._MODES:
             raise ValueError("Invalid Mode")
-        return
+        for attempt in range(MODE_ATTEMPTS):
+            ret = await self._device._write_readline(mode)
+            if ret.split()[:1] == [mode]:
+                break
+            await anyio.sleep(0.01 * 2**attempt)
+        else:
+            raise ValueError(f"Gas Card Did Not Enter {mode} Mode")
+        self._current_mode = mode
+        return ret
+
+    async def _readline_mode(self, mode: str) -> str:
+        """Reads the next line from the device in the given mode.
+
+        Switches the device to the mode first if needed, reusing the line read back by the switch. If the device has left the mode, the switch is made again with the bounded retries of _set_mode.
+
+        Args:
+            mode (str): Desired mode for device
+
+        Returns:
+            str: Line received in the given mode
+        """
+        if self._current_mode == mode:
+            ret = await self._device._readline()
+            if ret.split()[:1] == [mode]:
+                return ret
+        return await self._set_mode(mode)
+
+    async def _read_mode(self, mode: str) -> dict[str, str | float]:
+        """Reads the next line from the device in the given mode and parses it.
+
+        If cache_ttl is set, a reading of the mode taken within that many seconds is returned instead.
+
+        Args:
+            mode (str): Desired mode for device
+
+        Returns:
+            dict[str, str | float]: Dataframe of the given mode
+        """
+        if self.cache_ttl:
+            cached = self._cache.get(mode)
+            if cached and time.monotonic() - cached[0] < self.cache_ttl:
+                return dict(cached[1])
+        ret = _parse_row(await self._readline_mode(mode), mode)
+        if self.cache_ttl:
+            self._cache[mode] = (time.monotonic(), dict(ret))
+        return ret
 
     async def _get_val(self) -> dict[str, str | float]:
         """Gets the current value of the device.
@@ -117,19 +273,7 @@ class Gascard(ABC):
         Returns:
             dict[str, str | float]: Normal (N) mode dataframe
         """
-        if self._current_mode != "N":
-            await self._set_mode("N")
-        ret = await self._device._readline()
-        ret = ret.replace("\x00", "")
-        df = ret.split()
-        if "N" not in df[0]:
-            raise ValueError("Gas Card Not in Normal Mode")
-        for index in range(len(df)):
-            try:
-                df[index] = float(df[index])
-            except ValueError:
-                pass
-        return dict(zip(N_labels, df))
+        return await self._read_mode("N")
 
     async def _get_raw(self) -> dict[str, str | float]:
         """Gets the raw sensor output.
@@ -137,19 +281,7 @@ class Gascard(ABC):
         Returns:
             dict[str, str | float]: Normal Channel (N1) mode Dataframe
         """
-        if self._current_mode != "N1":
-            await self._set_mode("N1")
-        ret = await self._device._readline()
-        ret = ret.replace("\x00", "")
-        df = ret.split()
-        if "N1" not in df[:2]:
-            raise ValueError("Gas Card Not in Normal Mode")
-        for index in range(len(df)):
-            try:
-                df[index] = float(df[index])
-            except ValueError:
-                pass
-        return dict(zip(N1_labels, df))
+        return await self._read_mode("N1")
 
     async def _get_coeff(self) -> dict[str, str | float]:
         """Gets the current value of the device.
@@ -157,19 +289,7 @@ class Gascard(ABC):
         Returns:
             dict[str, str | float]: Coefficient Channel (C1) mode dataframe
         """
-        if self._current_mode != "C1":
-            await self._set_mode("C1")
-        ret = await self._device._readline()
-        ret = ret.replace("\x00", "")
-        df = ret.split()
-        if "C1" not in df[:2]:
-            raise ValueError("Gas Card Not in Coefficient Mode")
-        for index in range(len(df)):
-            try:
-                df[index] = float(df[index])
-            except ValueError:
-                pass
-        return dict(zip(C1_labels, df))
+        return await self._read_mode("C1")
 
     async def _get_environmental(self) -> dict[str, str | float]:
         """Gets environmental parameters.
@@ -180,19 +300,7 @@ class Gascard(ABC):
         Returns:
             dict: Environmental Mode (E1) dataframe
         """
-        if self._current_mode != "E1":
-            await self._set_mode("E1")
-        ret = await self._device._readline()
-        ret = ret.replace("\x00", "")
-        df = ret.split()
-        if "E" not in df[0]:
-            raise ValueError("Gas Card Not in Environmental Mode")
-        for index in range(len(df)):
-            try:
-                df[index] = float(df[index])
-            except ValueError:
-                pass
-        return dict(zip(E1_labels, df))
+        return await self._read_mode("E1")
 
     async def _get_output(self) -> dict[str, str | float]:
         """Display and Change output variables.
@@ -200,19 +308,7 @@ class Gascard(ABC):
         Returns:
             dict[str, str | float]: Output Channel Mode (O1) dataframe
         """
-        if self._current_mode != "O1":
-            await self._set_mode("O1")
-        ret = await self._device._readline()
-        ret = ret.replace("\x00", "")
-        df = ret.split()
-        if "O1" not in df[0:2]:
-            raise ValueError("Gas Card Not in Output Mode")
-        for index in range(len(df)):
-            try:
-                df[index] = float(df[index])
-            except ValueError:
-                pass
-        return dict(zip(O1_labels, df))
+        return await self._read_mode("O1")
 
     async def _get_settings(self) -> dict[str, str | float]:
         """Display and Change Settings.
@@ -220,19 +316,7 @@ class Gascard(ABC):
         Returns:
             dict[str, str | float]: Settings mode (X) dataframe
         """
-        if self._current_mode != "X":
-            await self._set_mode("X")
-        ret = await self._device._readline()
-        ret = ret.replace("\x00", "")
-        df = ret.split()
-        if "X" not in df[0]:
-            raise ValueError("Gas Card Not in Settings Mode")
-        for index in range(len(df)):
-            try:
-                df[index] = float(df[index])
-            except ValueError:
-                pass
-        return dict(zip(X_labels, df))
+        return await self._read_mode("X")
 
     async def _get_userinterface(self) -> dict[str, str | float]:
         """View user Interface.
@@ -241,83 +325,109 @@ class Gascard(ABC):
             dict[str, str | float]: User Interface mode (U) dataframe
         """
         acc_gas = ["CO", "CO2", "CH4"]
-        if self._current_mode != "U":
-            await self._set_mode("U")
-        ret = await self._device._readline()
-        ret = ret.replace("\x00", "")
-        df = ret.split()
-        if "U" not in df[0]:
-            raise ValueError("Gas Card Not in User Interface Mode")
-        for index in range(len(df)):
-            try:
-                df[index] = float(df[index])
-            except ValueError:
-                pass
-        if df[2] not in acc_gas:
+        ret = await self._read_mode("U")
+        if ret["Gas_Type"] not in acc_gas:
             raise ValueError("Gas Not Accepted")
-        return dict(zip(U_labels, df))
-
-    async def get(self, vals: list[str] | None = None) -> dict[str, str | float]:
+        return ret
+
+    _MODES_FUNC = {
+        "N": _get_val,
+        "N1": _get_raw,
+        "C1": _get_coeff,
+        "E1": _get_environmental,
+        "O1": _get_output,
+        "X": _get_settings,
+        "U": _get_userinterface,
+    }
+
+    async def get(
+        self, vals: list[str] | str | None = None
+    ) -> dict[str, str | float]:
         """General function to receive from device.
 
         Max acquisition rate seems to be 4 Hz
 
         Example:
-            df = run(dev.get, ["Gas Type", "Gas Range", "Conc 1"])
-            df = run(dev.get, "Gas Type")
+            df = run(dev.get, ["Gas_Type", "Gas_Range", "Conc_1"])
+            df = run(dev.get, "Gas_Type")
 
         Args:
             vals (list[str]): List of names (given in values dictionary) to receive from device.
 
         Returns:
             dict[str, str | float]: Dictionary of names requested with their values
+
+        Raises:
+            ValueError: If a name is unknown.
         """
         if not vals:
             return await self._get_val()
-        modes = []
+        if isinstance(vals, str):
+            vals = [vals]
+        modes = defaultdict(list)
         output = {}
         for val in vals:
-            for key, value in values.items():
-                for idx, names in enumerate(value[0]):
-                    if val == names:
-                        modes.append((key, names))
-        unique_modes = {i[0] for i in modes}
-        MODES_FUNC = {
-            "N": self._get_val,
-            "N1": self._get_raw,
-            "C1": self._get_coeff,
-            "E1": self._get_environmental,
-            "O1": self._get_output,
-            "X": self._get_settings,
-            "U": self._get_userinterface,
+            if val not in name_index:
+                raise ValueError(f"Invalid Name {val}")
+            modes[name_index[val][0]].append(val)
+        # All modes share one serial port, so read them in turn starting with the current one
+        for mode in sorted(modes, key=lambda mode: mode != self._current_mode):
+            names = modes[mode]
+            ret = await self._MODES_FUNC[mode](self)
+            output.update((name, ret[name]) for name in names)
+        return output
+
+    async def stream(self, mode: str, n: int) -> dict[str, list[str | float]]:
+        """Reads consecutive lines from the device in a single mode.
+
+        Values are collected per name rather than per line, ready for plotting or further processing of the series.
+
+        Example:
+            df = run(dev.stream, "N", 20)
+
+        Args:
+            mode (str): Mode to read from (N, N1, C1, E1, O1, X or U)
+            n (int): Number of lines to read
+
+        Returns:
+            dict[str, list[str | float]]: List of values for each name in the mode
+        """
+        if mode not in mode_labels:
+            raise ValueError("Invalid Mode")
+        output: dict[str, list[str | float]] = {
+            name: [] for name in mode_labels[mode][1:]
         }
-        for mode in unique_modes:
-            ret = await MODES_FUNC[mode]()
-            names = [i[1] for i in modes if i[0] == mode]
-            output.update({names: ret[names] for names in names})
+        for _ in range(n):
+            ret = await self._readline_mode(mode)
+            for name, val in _parse_row(ret, mode).items():
+                if name in output:
+                    output[name].append(val)
         return output
 
     async def set(self, params: dict[str, str | float]) -> None:
         """General function to send to device.
 
         Example:
-            df = run(dev.set, {"Time Constant": 0, "Pressure Sensor Offset Cor": 904})
+            df = run(dev.set, {"Time_Constant": 0, "Press_Sensor_Offset_Cor": 904})
 
         Args:
             params (dict[str, str | float]): Variable:Value pairs for each desired set
+
+        Raises:
+            ValueError: If a variable is unknown or read only.
         """
-        modes = []
+        self._cache.clear()  # Settings can change the readings of any mode
+        modes = defaultdict(list)
         for key, value in params.items():
-            for key2, value2 in values.items():
-                for idx, names in enumerate(value2[0]):
-                    if key == names:
-                        modes.append((key2, value2[1][idx], value))
-        unique_modes = {i[0] for i in modes}
-        for mode in unique_modes:
+            if key not in settable:
+                raise ValueError(f"Invalid Setting {key}")
+            mode, command = name_index[key]
+            modes[mode].append(f"{command}{value}")
+        for mode, commands in modes.items():
             if self._current_mode != mode:
                 await self._set_mode(mode)
-            for val in [i for i in modes if i[0] == mode]:
-                await self._device._write(f"{val[1]}{val[2]}")
+            for command in commands:
+                await self._device._write(command)
         return
 
     async def zero(self) -> None:
@@ -342,11 +452,28 @@ class Gascard(ABC):
             **Device MUST be flowing span gas BEFORE calling this function.**
 
         Args:
-            val (dict[str, float]): Gas concentration as a fraction of full scale (0.5 to 1.2)
+            val (float): Gas concentration as a fraction of full scale (0.5 to 1.2)
         """
         await self.set({"Span_Gas_Corr_Factor": val})
         return
 
+    async def coefficients(self, a: float, b: float, c: float, d: float) -> None:
+        """Sets the linearisation coefficients of the device.
+
+        All four are sent in a single coefficient mode session.
+
+        Example:
+            df = run(dev.coefficients, 0.1, 0.2, 0.3, 0.4)
+
+        Args:
+            a (float): Coefficient A
+            b (float): Coefficient B
+            c (float): Coefficient C
+            d (float): Coefficient D
+        """
+        await self.set({"CoeffA": a, "CoeffB": b, "CoeffC": c, "CoeffD": d})
+        return
+
     async def time_const(self, val: int) -> None:
         """Sets the time constant of the RC filter of the device.
 
@@ -355,6 +482,11 @@ class Gascard(ABC):
 
         Args:
             val (int): Time constant in seconds (0 to 120)
+
+        Raises:
+            ValueError: If the time constant is out of range.
         """
+        if not 0 <= val <= 120:
+            raise ValueError("Time Constant Out of Range")
         await self.set({"Time_Constant": val})
         return
@@ -4,17 +4,34 @@ Author: Grayson Bellamy
 Date: 2024-05-03
 """
 
-import glob
+import json
+import os
 import re
+import sys
+import time
+from contextlib import nullcontext
+from pathlib import Path
 from typing import Any
 
 import anyio
 from anyio import create_task_group, run
+from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
 
 from pygascard import daq, device
 from pygascard.comm import SerialDevice
 from pygascard.device import Gascard
 
+PROBE_TTL = 5.0  # Seconds a successful probe is reused before the port is probed again
+# Port: (inode of the device node, time of the probe, device information), so a replugged adapter is probed again
+_probe_cache: dict[str, tuple[int, float, dict[str, str]]] = {}
+# USB serial adapters are named differently on macOS
+PORT_PATTERN = re.compile(
+    r"tty\.usbserial.*" if sys.platform == "darwin" else r"ttyUSB\d+"
+)
+PORTS_TTL = 2.0  # Seconds a listing of serial ports is reused before listing again
+# Pattern: (time listed, ports)
+_ports_cache: dict[re.Pattern[str], tuple[float, list[str]]] = {}
+
 
 def gas_correction():
     """Calculates the gas correction factor for the gascard device.
@@ -25,58 +42,258 @@ def gas_correction():
     pass
 
 
+async def _probe(
+    port: str, limiter: anyio.CapacityLimiter | None, probe_timeout: float
+) -> Gascard | None:
+    """Probes a port for a gascard device, waiting for the limiter if given.
+
+    Args:
+        port (str): The name of the serial port.
+        limiter (anyio.CapacityLimiter): Limits how many ports are probed at once.
+        probe_timeout (float): Time in seconds to wait for the device to answer.
+
+    Returns:
+        device.Gascard | None: The gascard device object, None if the port is not a gascard device.
+    """
+    async with limiter or nullcontext():
+        return await is_gascard_device(port, probe_timeout)
+
+
 async def update_dict_dev(
-    devices: dict[str, str | Gascard], port: str
-) -> dict[str, str | Gascard]:
+    devices: dict[str, Gascard],
+    port: str,
+    limiter: anyio.CapacityLimiter | None = None,
+    probe_timeout: float = 2.0,
+) -> dict[str, Gascard]:
     """Updates the dictionary with the new values.
 
     Args:
         devices (dict): The dictionary of devices.
         port (str): The name of the serial port.
+        limiter (anyio.CapacityLimiter): Limits how many ports are probed at once.
+        probe_timeout (float): Time in seconds to wait for the device to answer.
 
     Returns:
         dict: The dictionary of devices with the updated values.
     """
-    dev = await is_gascard_device(port)
-    if dev:
-        devices.update({port: dev[1]})
+    dev = await _probe(port, limiter, probe_timeout)
+    if dev is not None:
+        devices.update({port: dev})
     return devices
 
 
-async def find_devices() -> dict[str, Gascard]:
+async def _list_ports(
+    pattern: re.Pattern[str], refresh: bool = False
+) -> list[str]:
+    """Lists the serial ports matching a pattern, reusing a listing from the last PORTS_TTL seconds.
+
+    The directory is read in a worker thread so a slow /dev does not stall other tasks.
+
+    Args:
+        pattern (re.Pattern[str]): Pattern of the serial port names under /dev.
+        refresh (bool): Whether to list the ports again regardless of age.
+
+    Returns:
+        list[str]: The names of the serial ports.
+    """
+    cached = _ports_cache.get(pattern)
+    if not refresh and cached and time.monotonic() - cached[0] < PORTS_TTL:
+        return cached[1]
+    names = await anyio.to_thread.run_sync(os.listdir, "/dev")
+    ports = [f"/dev/{name}" for name in names if pattern.fullmatch(name)]
+    _ports_cache[pattern] = (time.monotonic(), ports)
+    return ports
+
+
+def _cache_path() -> Path:
+    """Gets the file the ports of found devices are saved to.
+
+    Resolved on use so importing the module does not depend on a home directory.
+
+    Returns:
+        Path: The path of the cache file.
+    """
+    return Path.home() / ".cache" / "pygascard" / "devices.json"
+
+
+def _load_cache() -> list[str]:
+    """Loads the ports of the devices found by a previous process.
+
+    Only ports matching PORT_PATTERN under /dev are returned, whatever the file contains.
+
+    Returns:
+        list[str]: The names of the serial ports, empty if there is no usable cache.
+    """
+    try:
+        with open(_cache_path()) as f:
+            ports = list(json.load(f))
+    except (OSError, RuntimeError, ValueError, TypeError):
+        return []
+    return [
+        port
+        for port in ports
+        if isinstance(port, str)
+        and os.path.dirname(port) == "/dev"
+        and PORT_PATTERN.fullmatch(os.path.basename(port))
+    ]
+
+
+def _save_cache(cache: dict[str, dict[str, str | float]]) -> None:
+    """Saves the ports of the devices found, along with their information, for later processes.
+
+    Args:
+        cache (dict[str, dict]): The information of each device found. Port:Information
+    """
+    try:
+        path = _cache_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(cache, f)
+    except (OSError, RuntimeError):
+        pass  # The cache only saves time, discovery works without it
+
+
+async def find_devices(
+    refresh: bool = False,
+    limit: int = 8,
+    probe_timeout: float = 2.0,
+    use_cache: bool = False,
+) -> dict[str, Gascard]:
     """Finds all connected gascard devices.
 
+    Recent port listings and probes are reused, so only new or replugged ports are probed again.
+
+    Args:
+        refresh (bool): Whether to list and probe every port again.
+        limit (int): Maximum number of ports probed at once.
+        probe_timeout (float): Time in seconds to wait for each device to answer.
+        use_cache (bool): Whether to also probe the ports saved by a previous process, and save the ones found.
+
     Returns:
         dict[str, device.Gascard]: A dictionary of all connected Gascard devices. Port:Object
     """
-    # Get the list of available serial ports
-    result = glob.glob("/dev/ttyUSB*")
-
-    # Iterate through the output and check for gascard devices
-    devices = {}
+    devices: dict[str, Gascard] = {}
+    send: MemoryObjectSendStream[tuple[str, Gascard]]
+    receive: MemoryObjectReceiveStream[tuple[str, Gascard]]
+    send, receive = anyio.create_memory_object_stream()
     async with create_task_group() as g:
-        for port in result:
-            g.start_soon(update_dict_dev, devices, port)
+        g.start_soon(
+            find_devices_stream, send, refresh, limit, probe_timeout, use_cache
+        )
+        async with receive:
+            async for port, dev in receive:
+                devices.update({port: dev})
+    if use_cache and devices:
+        cache = {
+            port: {**dev._dev_info, "Last_Seen": time.time()}
+            for port, dev in devices.items()
+        }
+        await anyio.to_thread.run_sync(_save_cache, cache)
     return devices
 
 
+async def send_device(
+    send: MemoryObjectSendStream[tuple[str, Gascard]],
+    port: str,
+    limiter: anyio.CapacityLimiter | None = None,
+    probe_timeout: float = 2.0,
+) -> None:
+    """Probes a port and sends the device on if it is a gascard device.
+
+    Args:
+        send (MemoryObjectSendStream): Stream the port and device are sent to.
+        port (str): The name of the serial port.
+        limiter (anyio.CapacityLimiter): Limits how many ports are probed at once.
+        probe_timeout (float): Time in seconds to wait for the device to answer.
+    """
+    dev = await _probe(port, limiter, probe_timeout)
+    if dev is not None:
+        await send.send((port, dev))
+
+
+async def find_devices_stream(
+    send: MemoryObjectSendStream[tuple[str, Gascard]],
+    refresh: bool = False,
+    limit: int = 8,
+    probe_timeout: float = 2.0,
+    use_cache: bool = False,
+) -> None:
+    """Finds all connected gascard devices, sending each one as soon as it answers.
+
+    A device can be used before the slowest port has been probed. The stream is closed once every port has been probed. find_devices collects this stream into a dictionary.
+
+    Example:
+        send, receive = anyio.create_memory_object_stream()
+        async with create_task_group() as g:
+            g.start_soon(find_devices_stream, send)
+            async with receive:
+                async for port, dev in receive:
+                    ...
+
+    Args:
+        send (MemoryObjectSendStream): Stream the ports and devices are sent to.
+        refresh (bool): Whether to list and probe every port again.
+        limit (int): Maximum number of ports probed at once.
+        probe_timeout (float): Time in seconds to wait for each device to answer.
+        use_cache (bool): Whether to also probe the ports saved by a previous process.
+    """
+    async with send:
+        # Get the list of available serial ports
+        result = await _list_ports(PORT_PATTERN, refresh)
+        if refresh:
+            _probe_cache.clear()
+        if use_cache:
+            # Merged with the listing so devices plugged in since are still found
+            cached = await anyio.to_thread.run_sync(_load_cache)
+            result = list(dict.fromkeys([*cached, *result]))
+
+        # Iterate through the output and check for gascard devices
+        if len(result) == 1:  # Nothing to run alongside a single probe
+            await send_device(send, result[0], probe_timeout=probe_timeout)
+            return
+        limiter = anyio.CapacityLimiter(limit)
+        async with create_task_group() as g:
+            for port in result:
+                g.start_soon(send_device, send, port, limiter, probe_timeout)
+
+
 async def is_gascard_device(
-    port: str, **kwargs: Any
-) -> bool | tuple[bool, device.Gascard]:
+    port: str, probe_timeout: float = 2.0, **kwargs: Any
+) -> device.Gascard | None:
     """Check if the given port is an gascard device.
 
+    A successful probe without keyword arguments is reused for PROBE_TTL seconds,
+    as long as the device node has not been recreated. A new device object is returned either way.
+
     Parameters:
         port (str): The name of the serial port.
+        probe_timeout (float): Time in seconds to wait for the device to answer.
         **kwargs: Any additional keyword arguments.
 
     Returns:
-        bool: True if the port is an gascard device, False otherwise.
-        device.Gascard: The gascard device object.
+        device.Gascard | None: The gascard device object, None if the port is not a gascard device.
     """
     try:
-        return (True, await device.Gascard.new_device(port, **kwargs))
-    except ValueError:
-        return False
+        inode = os.stat(port).st_ino
+    except OSError:
+        _probe_cache.pop(port, None)
+        return None
+    cached = _probe_cache.get(port)
+    if (
+        not kwargs
+        and cached
+        and cached[0] == inode
+        and time.monotonic() - cached[1] < PROBE_TTL
+    ):
+        return Gascard.from_info(port, dict(cached[2]))
+    try:
+        dev = await device.Gascard.new_device(port, probe_timeout, **kwargs)
+    except (ValueError, TimeoutError):
+        _probe_cache.pop(port, None)
+        return None
+    if not kwargs:
+        _probe_cache[port] = (inode, time.monotonic(), dict(dev._dev_info))
+    return dev
 
 
 def get_device_type(port):
@@ -100,25 +317,35 @@ async def diagnose():
     set_code = "Time_Constant"
     devs = await find_devices()
     print(f"Devices: {devs}")
-    Daq = await daq.DAQ.init({"A": list(devs.keys())[0]})
+    ports = list(devs)
+    found = list(devs.values())
+    # Hand the probed devices to the DAQ rather than opening their ports again
+    Daq = await daq.DAQ.init({"A": found[0]})
     print(f"Initiate DAQ with A: {await Daq.dev_list()}")
-    await Daq.add_device({"B": list(devs.keys())[1]})
+    await Daq.add_device({"B": found[1]})
     print(f"Add device B: {await Daq.dev_list()}")
-    print(f"Get data (list): {await Daq.get([get_code1, get_code2])}")
-    temp = await Daq.get(set_code, "B")
-    print(f"Get Data (id, no list): Temp = {temp}")
+    temp = await Daq.get([get_code1, get_code2, set_code])
+    print(f"Get data (list): {temp}")
+    base = temp["B"][set_code]
     await Daq.remove_device(["A"])
     print(f"Remove device A: {await Daq.dev_list()}")
     print(f"Set data (with id).")
-    await Daq.set({set_code: (temp["B"][set_code] + 1)}, "B")
-    print(f"Get data: {await Daq.get([set_code])}")
+    ret = await Daq.set_and_read({set_code: base + 1}, ["B"])
+    print(f"Get data: {ret}")
     print(f"Set data (without id).")
-    await Daq.set({set_code: temp["B"][set_code]})
-    print(f"Get data: {await Daq.get([set_code])}")
-    await Daq.add_device({"C": list(devs.keys())[0]})
+    ret = await Daq.set_and_read({set_code: base})
+    print(f"Get data: {ret}")
+    # A's device was closed when it was removed, so C opens the port afresh
+    await Daq.add_device({"C": ports[0]})
     print(f"Add device C: {await Daq.dev_list()}")
     print(f"Convenience Function.")
-    await Daq.time_const(temp["B"][set_code] + 1)
-    print(f"Get data: {await Daq.get([set_code])}")
-    await Daq.time_const(temp["B"][set_code])
-    print(f"Get data: {await Daq.get([set_code])}")
+    await Daq.time_const(base + 1)
+    ret = await Daq.get([set_code])
+    print(f"Get data: {ret}")
+    if any(vals[set_code] != base + 1 for vals in ret.values()):
+        raise ValueError(f"{set_code} Not Changed")
+    await Daq.time_const(base)
+    ret = await Daq.get([set_code])
+    print(f"Get data: {ret}")
+    if any(vals[set_code] != base for vals in ret.values()):
+        raise ValueError(f"{set_code} Not Restored")
@@ -0,0 +1,20 @@
+"""Tests for the gascard communication module."""
+
+import pytest
+
+from pygascard.comm import _decode
+
+
+@pytest.mark.parametrize(
+    ("line", "expected"),
+    [
+        (b"N 0.0123 24.5\r\n", "N 0.0123 24.5\r\n"),
+        (b"\x00\x00N 0.0123 24.5\r\n", "N 0.0123 24.5\r\n"),
+        (b"N 0.0123\x00 24.5\r\n\x00", "N 0.0123 24.5\r\n"),
+        (b"\x00\x00", ""),
+        (b"", ""),
+    ],
+)
+def test_decode(line, expected):
+    """Null padding is removed wherever it appears in a line."""
+    assert _decode(line) == expected
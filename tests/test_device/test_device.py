@@ -0,0 +1,134 @@
+"""Tests for the gascard device module."""
+
+import anyio
+import pytest
+
+from pygascard import device
+from pygascard.device import _parse_row
+
+# One line per mode in the format the card sends, fields in codes.json order
+SAMPLE_LINES = {
+    "N": "N 0.0123 0.0000 0.0000 0.0000 0.0000 24.5 1013.2 45.1",
+    "N1": "N1 41235 39876 2048 0.0123 24.5 1013.2",
+    "C1": "C1 0.0101 0.0202 0.0303 0.0404 1.0000 1.0000 128 128 200 200",
+    "E1": "E1 25.0 25.0 1.0000 0.0000 0.0 0.0 0.0 1.0 0.0 0.0",
+    "O1": "O1 1.0000 0.0000 2048 1.0000 0.0000 1024",
+    "X": "X 2.05 12345 0x1F 2 1 0",
+    "U": "U 100 CO2 N2 1",
+}
+
+
+class FakeSerial:
+    """Stands in for the serial layer, answering mode changes with a sample line."""
+
+    def __init__(self):
+        """Starts with nothing written."""
+        self.written = []
+
+    async def _write(self, command):
+        """Records a command."""
+        self.written.append(command)
+
+    async def _write_readline(self, command):
+        """Records a command and answers with a line in the mode it names."""
+        self.written.append(command)
+        return SAMPLE_LINES[command]
+
+
+def fake_gascard():
+    """Creates a gas card on a fake serial layer."""
+    dev_info = dict(zip(device.U_labels, SAMPLE_LINES["U"].split()))
+    return device.Gascard(FakeSerial(), dev_info)
+
+
+@pytest.mark.parametrize(("mode", "line"), SAMPLE_LINES.items())
+def test_parse_row(mode, line):
+    """Every value of a line is paired with its name, numbers as floats."""
+    row = _parse_row(line + "\r\n", mode)
+    assert list(row) == list(device.mode_labels[mode])
+    assert row["Mode"] == mode
+    for name, val in zip(device.mode_labels[mode][1:], line.split()[1:]):
+        try:
+            expected = float(val)
+        except ValueError:
+            expected = val
+        assert row[name] == expected
+
+
+@pytest.mark.parametrize(
+    ("mode", "line"),
+    [
+        ("N", SAMPLE_LINES["N1"]),
+        ("N1", SAMPLE_LINES["N"]),
+        ("E1", "E 25.0 25.0"),
+        ("U", ""),
+        ("X", "   "),
+    ],
+)
+def test_parse_row_wrong_mode(mode, line):
+    """Lines from another mode, or empty lines, are rejected."""
+    with pytest.raises(ValueError, match=device.mode_names[mode]):
+        _parse_row(line, mode)
+
+
+@pytest.mark.parametrize("mode", device.mode_labels)
+def test_name_index(mode):
+    """Every name of a mode is indexed to that mode and its command prefix."""
+    names, commands = device.values[mode]
+    # Mode heads every line, so it is the one name shared between modes
+    for name, command in zip(names[1:], commands[1:]):
+        assert device.name_index[name] == (mode, command)
+
+
+@pytest.mark.parametrize(
+    ("name", "expected"),
+    [
+        ("Time_Constant", True),
+        ("CoeffA", True),
+        ("Display_Selection", True),
+        ("Conc_1", False),
+        ("Mode", False),
+        ("Firmware_Version", False),
+        ("Not_A_Name", False),
+    ],
+)
+def test_settable(name, expected):
+    """Only names with a command prefix can be set."""
+    assert (name in device.settable) is expected
+
+
+def test_set():
+    """Settings are grouped per mode, switching mode once for each group."""
+    dev = fake_gascard()
+    anyio.run(
+        dev.set,
+        {"Time_Constant": 2, "CoeffA": 0.1, "Frequency": 5, "CoeffB": 0.2},
+    )
+    assert dev._device.written == ["X", "t2", "f5", "C1", "h0.1", "i0.2"]
+    assert dev._current_mode == "C1"
+
+
+@pytest.mark.parametrize("name", ["Conc_1", "Firmware_Version", "Not_A_Name"])
+def test_set_invalid(name):
+    """Read only or unknown names are rejected before anything is written."""
+    dev = fake_gascard()
+    with pytest.raises(ValueError, match=f"Invalid Setting {name}"):
+        anyio.run(dev.set, {"Time_Constant": 2, name: 1})
+    assert dev._device.written == []
+
+
+@pytest.mark.parametrize("val", [0, 60, 120])
+def test_time_const(val):
+    """Time constants within range are written in Settings mode."""
+    dev = fake_gascard()
+    anyio.run(dev.time_const, val)
+    assert dev._device.written == ["X", f"t{val}"]
+
+
+@pytest.mark.parametrize("val", [-1, 121])
+def test_time_const_out_of_range(val):
+    """Time constants out of range are rejected before anything is written."""
+    dev = fake_gascard()
+    with pytest.raises(ValueError, match="Time Constant Out of Range"):
+        anyio.run(dev.time_const, val)
+    assert dev._device.written == []
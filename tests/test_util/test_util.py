@@ -0,0 +1,149 @@
+"""Tests for the gascard utilities module."""
+
+import json
+import re
+
+import anyio
+import pytest
+
+from pygascard import util
+
+
+class FakeGascard:
+    """Stands in for a gas card found on a port."""
+
+    def __init__(self, port):
+        """Keeps the port as the device information."""
+        self._dev_info = {"Port": port}
+
+
+@pytest.fixture
+def cache_file(tmp_path, monkeypatch):
+    """Points the cache at a temporary file and fixes the port pattern."""
+    path = tmp_path / "pygascard" / "devices.json"
+    monkeypatch.setattr(util, "_cache_path", lambda: path)
+    monkeypatch.setattr(util, "PORT_PATTERN", re.compile(r"ttyUSB\d+"))
+    return path
+
+
+@pytest.fixture
+def ports(monkeypatch):
+    """Fakes the port listing and the probes, with gas cards on ports 0, 2 and 5."""
+    listed = ["/dev/ttyUSB0", "/dev/ttyUSB1", "/dev/ttyUSB2"]
+    gascards = ["/dev/ttyUSB0", "/dev/ttyUSB2", "/dev/ttyUSB5"]
+
+    async def list_ports(pattern, refresh=False):
+        return listed
+
+    async def is_gascard_device(port, probe_timeout=2.0):
+        return FakeGascard(port) if port in gascards else None
+
+    monkeypatch.setattr(util, "_list_ports", list_ports)
+    monkeypatch.setattr(util, "is_gascard_device", is_gascard_device)
+    return listed
+
+
+def test_cache_path():
+    """The cache lives under the home directory."""
+    assert util._cache_path().parts[-3:] == (".cache", "pygascard", "devices.json")
+
+
+def test_save_load_cache(cache_file):
+    """Saved ports are loaded back, creating the directory on the way."""
+    util._save_cache({"/dev/ttyUSB0": {"Gas_Type": "CO2", "Last_Seen": 1.0}})
+    assert json.loads(cache_file.read_text()) == {
+        "/dev/ttyUSB0": {"Gas_Type": "CO2", "Last_Seen": 1.0}
+    }
+    assert util._load_cache() == ["/dev/ttyUSB0"]
+
+
+def test_load_cache_missing(cache_file):
+    """No cache file gives no ports."""
+    assert util._load_cache() == []
+
+
+@pytest.mark.parametrize("text", ["", "{not json", "3", "null"])
+def test_load_cache_invalid(cache_file, text):
+    """A cache file which is not a JSON collection gives no ports."""
+    cache_file.parent.mkdir(parents=True)
+    cache_file.write_text(text)
+    assert util._load_cache() == []
+
+
+def test_load_cache_filter(cache_file):
+    """Only names of serial ports directly under /dev are kept."""
+    cache_file.parent.mkdir(parents=True)
+    entries = [
+        "/dev/ttyUSB0",
+        "/dev/ttyS0",
+        "/dev/ttyUSB1x",
+        "/tmp/ttyUSB2",
+        "/dev/sub/ttyUSB3",
+        "ttyUSB4",
+        5,
+        ["/dev/ttyUSB6"],
+        "/dev/ttyUSB7",
+    ]
+    cache_file.write_text(json.dumps(entries))
+    assert util._load_cache() == ["/dev/ttyUSB0", "/dev/ttyUSB7"]
+
+
+def test_find_devices_cache(cache_file, ports):
+    """Cached ports are probed along with listed ones, devices found are saved."""
+    cache_file.parent.mkdir(parents=True)
+    cache_file.write_text(json.dumps(["/dev/ttyUSB5", "/dev/ttyUSB2"]))
+    devices = anyio.run(util.find_devices, False, 8, 2.0, True)
+    assert set(devices) == {"/dev/ttyUSB0", "/dev/ttyUSB2", "/dev/ttyUSB5"}
+    saved = json.loads(cache_file.read_text())
+    assert set(saved) == set(devices)
+    for port, info in saved.items():
+        assert info["Port"] == port
+        assert "Last_Seen" in info
+
+
+def test_find_devices_no_cache(cache_file, ports):
+    """Without use_cache the cache file is neither read nor written."""
+    cache_file.parent.mkdir(parents=True)
+    cache_file.write_text(json.dumps(["/dev/ttyUSB5"]))
+    devices = anyio.run(util.find_devices)
+    assert set(devices) == {"/dev/ttyUSB0", "/dev/ttyUSB2"}
+    assert json.loads(cache_file.read_text()) == ["/dev/ttyUSB5"]
+
+
+async def collect_stream(**kwargs):
+    """Collects what find_devices_stream sends, in order."""
+    found = []
+    send, receive = anyio.create_memory_object_stream()
+    async with anyio.create_task_group() as g:
+        g.start_soon(lambda: util.find_devices_stream(send, **kwargs))
+        async with receive:
+            async for port, dev in receive:
+                found.append((port, dev))
+    return found
+
+
+def test_find_devices_stream(ports):
+    """Each gas card is sent once with its port and the stream is closed afterwards."""
+    found = anyio.run(collect_stream)
+    assert sorted(port for port, _ in found) == ["/dev/ttyUSB0", "/dev/ttyUSB2"]
+    assert all(dev._dev_info["Port"] == port for port, dev in found)
+
+
+def test_find_devices_stream_single(ports):
+    """A single listed port is probed and sent like any other."""
+    del ports[1:]
+    assert [port for port, _ in anyio.run(collect_stream)] == ["/dev/ttyUSB0"]
+
+
+def test_find_devices_stream_none(ports):
+    """No listed ports closes the stream without sending anything."""
+    ports.clear()
+    assert anyio.run(collect_stream) == []
+
+
+def test_update_dict_dev(ports):
+    """Only ports holding a gas card are added."""
+    devices = {}
+    anyio.run(util.update_dict_dev, devices, "/dev/ttyUSB0")
+    anyio.run(util.update_dict_dev, devices, "/dev/ttyUSB1")
+    assert list(devices) == ["/dev/ttyUSB0"]